@@ -2,19 +2,18 @@ import logging
 import json
 import os
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
-from queue import Queue
 
 import threading
 import time
 
 from utils.cdc_config import CDCConfig
+from utils.event_router import EventRouter, HandlerSpec
 from utils.postgre_cdc_consumer import PostgresCDCConsumer
 
 
-EVENT_QUEUE = Queue(maxsize=1000)  # backpressure protection
-
 load_dotenv()
 
 logging.basicConfig(
@@ -24,54 +23,158 @@ logger = logging.getLogger(__name__)
 
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
+    router = None  # set once routing is configured, serves /metrics
+    state_store = None  # set when CDC_STATE_TABLES is configured, serves /state
+    apply_scheduler = None  # set when CDC_APPLY_TARGET_DSN is configured
+
     def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == "/metrics" and self.router is not None:
+            self.send_json(200, self.router.metrics())
+            return
+
+        if url.path == "/metrics/apply" and self.apply_scheduler is not None:
+            self.send_json(200, self.apply_scheduler.metrics())
+            return
+
+        if url.path.startswith("/state") and self.state_store is not None:
+            try:
+                status, body = self.read_state(url.path, parse_qs(url.query))
+            except (KeyError, ValueError, TimeoutError) as e:
+                status, body = 400, {"error": str(e)}
+            self.send_json(status, body)
+            return
+
+        if self.apply_scheduler is not None and self.apply_scheduler.failed:
+            self.send_response(503)
+            self.send_header("Content-type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"APPLY HALTED")
+            return
+
         self.send_response(200)
         self.send_header("Content-type", "text/plain")
         self.end_headers()
         self.wfile.write(b"OK")
 
+    def read_state(self, path: str, query: dict):
+        """
+        Serve reads from the materialized state store:
+          /state/snapshot[?min_lsn=N]                        all tables at one LSN
+          /state/<schema>.<table>?key=1                      point lookup
+          /state/<schema>.<table>?low=1&high=10              primary key range
+          /state/<schema>.<table>?column=email&value=a@b.c   secondary index
+        Composite keys are comma separated, in primary key column order.
+        """
+        target = path[len("/state/") :]
+
+        def param(name):
+            return query[name][0] if name in query else None
+
+        if target == "snapshot":
+            min_lsn = param("min_lsn")
+            snapshot = self.state_store.snapshot(
+                int(min_lsn) if min_lsn else None, timeout=5
+            )
+            return 200, {"lsn": snapshot.lsn, "tables": snapshot.tables}
+
+        schema, _, table = target.partition(".")
+        if not table:
+            raise ValueError("Expected /state/<schema>.<table> or /state/snapshot")
+
+        if param("key") is not None:
+            row = self.state_store.get(schema, table, tuple(param("key").split(",")))
+            return (200, row) if row else (404, {"error": "not found"})
+
+        if param("column") is not None:
+            rows = self.state_store.lookup(
+                schema, table, param("column"), param("value")
+            )
+            return 200, rows
+
+        low, high = param("low"), param("high")
+        rows = self.state_store.range(
+            schema,
+            table,
+            tuple(low.split(",")) if low else None,
+            tuple(high.split(",")) if high else None,
+        )
+        return 200, rows
+
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(data)
+
     def log_message(self, format, *args):
         pass  # Suppress health check logs
 
 
 def start_health_server(port: int):
-    server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
+    # Threaded so slow /state reads never hold up the health check
+    server = ThreadingHTTPServer(("0.0.0.0", port), HealthCheckHandler)
     logger.info(f"Health check server started on port {port}")
     server.serve_forever()
 
 
-def worker(worker_id: int, queue: Queue):
-    print(f"⚙️ Worker-{worker_id} started")
-
-    while True:
-        event = queue.get()  # blocks until event available
-
-        try:
-            print(
-                f"⚙️ Worker-{worker_id} processing "
-                f"{event.operation} on {event.schema}.{event.table}"
-            )
-
-            # 🔥 simulate real work
-            time.sleep(1)
-
-            print("\n" + "=" * 60)
-            print(f"🔔 CDC EVENT: {event.operation}")
-            print(f"   Table: {event.schema}.{event.table}")
-            print(f"   Time: {event.timestamp}")
+def process_event(event):
+    worker_name = threading.current_thread().name
+    print(
+        f"⚙️ Worker-{worker_name} processing "
+        f"{event.operation} on {event.schema}.{event.table}"
+    )
 
-            if event.old_values:
-                print(f"   Old Values: {json.dumps(event.old_values, indent=6)}")
-            if event.new_values:
-                print(f"   New Values: {json.dumps(event.new_values, indent=6)}")
+    # 🔥 simulate real work
+    time.sleep(1)
+
+    print("\n" + "=" * 60)
+    print(f"🔔 CDC EVENT: {event.operation}")
+    print(f"   Table: {event.schema}.{event.table}")
+    print(f"   Time: {event.timestamp}")
+
+    if event.changed_columns is not None:
+        print(f"   Changed: {json.dumps(event.changed_columns, indent=6)}")
+    else:
+        if event.old_values:
+            print(f"   Old Values: {json.dumps(event.old_values, indent=6)}")
+        if event.new_values:
+            print(f"   New Values: {json.dumps(event.new_values, indent=6)}")
+
+    print("=" * 60)
+
+
+def build_router() -> EventRouter:
+    """
+    Build the event router. CDC_ROUTING optionally holds JSON like:
+    {"handlers": {"realtime": {"pool_size": 2, "queue_size": 100,
+                               "priority": "critical"}},
+     "routes": {"public.users": ["realtime"], "public.*": ["default"]}}
+    Tables without a matching route go to the "default" handler.
+    """
+    routing = json.loads(os.environ.get("CDC_ROUTING", "{}"))
+
+    router = EventRouter(default_handlers=["default"])
+    router.register_handler(
+        HandlerSpec(
+            name="default",
+            callback=process_event,
+            pool_size=int(os.environ.get("CDC_WORKER_COUNT", 3)),
+            queue_size=1000,  # backpressure protection
+        )
+    )
 
-            print("=" * 60)
+    for name, options in routing.get("handlers", {}).items():
+        router.register_handler(
+            HandlerSpec(name=name, callback=process_event, **options)
+        )
 
-        except Exception as e:
-            print(f"❌ Worker-{worker_id} failed: {e}")
+    for pattern, handler_names in routing.get("routes", {}).items():
+        router.add_route(pattern, handler_names)
 
-        finally:
-            queue.task_done()
+    return router
 
 
 def main():
@@ -86,22 +189,26 @@ def main():
 
     consumer = PostgresCDCConsumer(config)
 
+    router = build_router()
+    HealthCheckHandler.router = router
+    HealthCheckHandler.state_store = consumer.state_store
+    HealthCheckHandler.apply_scheduler = consumer.apply_scheduler
+    # Recompile a table's dispatch entry whenever its relation is (re)announced
+    consumer.parser.on_relation = router.compile_relation
+
     def handle_event(event):
         """
-        Producer: puts CDC events into queue
+        Producer: routes CDC events to their handler queues
         """
-        EVENT_QUEUE.put(event, block=True)
+        router.route(event)
         print(f"📥 Enqueued: {event.operation} {event.table}")
 
     try:
         consumer.connect()
         consumer.create_replication_slot()
 
-        # Start worker threads
-
-        for i in range(int(os.environ.get("CDC_WORKER_COUNT", 3))):
-            t = threading.Thread(target=worker, args=(i, EVENT_QUEUE), daemon=True)
-            t.start()
+        # Start handler worker pools
+        router.start()
 
         consumer.start_replication(handle_event)
 
@@ -8,7 +8,11 @@ CREATE TABLE IF NOT EXISTS users (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Set REPLICA IDENTITY to FULL to get old values on UPDATE/DELETE
+-- Set REPLICA IDENTITY to FULL to get old values on UPDATE/DELETE.
+-- The row-image cache (CDC_ROW_CACHE_BYTES) keys rows by the primary key read
+-- from the catalog, so it works with either identity. If full old values are
+-- not needed, DEFAULT identity plus the cache still fills unchanged (TOAST)
+-- columns and avoids the extra WAL written for full old tuples.
 ALTER TABLE users REPLICA IDENTITY FULL;
 
 -- Create publication for CDC
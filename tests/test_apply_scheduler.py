@@ -0,0 +1,167 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+from utils.apply_scheduler import ApplyHaltedError, TransactionApplyScheduler
+from utils.cdc_event import CDCEvent
+
+
+class FakeConnection:
+    closed = False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def insert(xid: int, key: str) -> CDCEvent:
+    return CDCEvent(
+        operation="INSERT",
+        schema="public",
+        table="users",
+        columns=["id"],
+        new_values={"id": key},
+        key_columns=["id"],
+        xid=xid,
+    )
+
+
+def schedule(scheduler, xid: int, key: str, lsn: int):
+    scheduler.add(insert(xid, key))
+    scheduler.commit(xid, lsn)
+
+
+def wait_until(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+class GatedApply:
+    """apply_fn that blocks each xid until released, recording start order"""
+
+    def __init__(self):
+        self.started = []
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def release(self, xid: int):
+        self.gate(xid).set()
+
+    def gate(self, xid: int) -> threading.Event:
+        with self.lock:
+            return self.gates.setdefault(xid, threading.Event())
+
+    def __call__(self, connection, events):
+        xid = events[0].xid
+        with self.lock:
+            self.started.append(xid)
+        assert self.gate(xid).wait(5)
+
+
+def test_conflicting_transaction_waits_for_predecessor():
+    apply = GatedApply()
+    scheduler = TransactionApplyScheduler(FakeConnection, apply, pool_size=4)
+    scheduler.start()
+
+    schedule(scheduler, 1, "a", 10)
+    schedule(scheduler, 2, "a", 20)  # same row as xid 1
+    schedule(scheduler, 3, "b", 30)  # disjoint, runs concurrently
+
+    wait_until(lambda: sorted(apply.started) == [1, 3])
+    time.sleep(0.05)
+    assert 2 not in apply.started
+    assert scheduler.metrics()["held"] == 1
+
+    apply.release(1)
+    wait_until(lambda: 2 in apply.started)
+    apply.release(2)
+    apply.release(3)
+    wait_until(lambda: scheduler.acked_lsn == 30)
+
+
+def test_acked_lsn_only_advances_contiguously():
+    apply = GatedApply()
+    scheduler = TransactionApplyScheduler(FakeConnection, apply, pool_size=3)
+    scheduler.start()
+
+    schedule(scheduler, 1, "a", 10)
+    schedule(scheduler, 2, "b", 20)
+    schedule(scheduler, 3, "c", 30)
+    wait_until(lambda: len(apply.started) == 3)
+
+    # Later transactions finishing first must not move the ack
+    apply.release(3)
+    apply.release(2)
+    wait_until(lambda: scheduler.metrics()["applied"] == 2)
+    assert scheduler.acked_lsn == 0
+
+    apply.release(1)
+    wait_until(lambda: scheduler.acked_lsn == 30)
+    assert scheduler.metrics()["in_flight"] == 0
+
+
+def test_empty_transaction_advances_ack():
+    scheduler = TransactionApplyScheduler(FakeConnection, lambda c, e: None)
+    scheduler.commit(1, 10)
+    assert scheduler.acked_lsn == 10
+
+
+def test_halt_raises_instead_of_blocking_commit():
+    def fail(connection, events):
+        raise ValueError("bad event")
+
+    scheduler = TransactionApplyScheduler(
+        FakeConnection, fail, pool_size=1, max_in_flight=3
+    )
+    scheduler.start()
+
+    errors = []
+
+    def feed():
+        try:
+            for xid in range(1, 10):
+                schedule(scheduler, xid, str(xid), xid * 10)
+        except ApplyHaltedError as e:
+            errors.append(e)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    feeder.join(5)
+
+    assert not feeder.is_alive()
+    assert len(errors) == 1
+    assert scheduler.metrics()["failed_xid"] == 1
+    assert scheduler.acked_lsn == 0
+    with pytest.raises(ApplyHaltedError):
+        scheduler.commit(99, 990)
+
+
+def test_only_connection_errors_are_retried():
+    calls = {"bad": 0, "flaky": 0}
+
+    def apply(connection, events):
+        key = events[0].new_values["id"]
+        calls[key] += 1
+        if key == "bad":
+            raise ValueError("never succeeds")
+        if calls[key] == 1:
+            raise psycopg2.OperationalError("connection lost")
+
+    scheduler = TransactionApplyScheduler(
+        FakeConnection, apply, pool_size=1, max_retries=3, retry_delay=0
+    )
+    scheduler.start()
+
+    schedule(scheduler, 1, "flaky", 10)
+    wait_until(lambda: scheduler.acked_lsn == 10)
+    assert calls["flaky"] == 2
+
+    schedule(scheduler, 2, "bad", 20)
+    wait_until(lambda: scheduler.failed is not None)
+    assert calls["bad"] == 1
@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Any, Callable, Deque, Dict, FrozenSet, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+from utils.cdc_event import CDCEvent
+from utils.row_image_cache import UNCHANGED
+
+logger = logging.getLogger(__name__)
+
+# (schema.table, key) - a key of None stands for the whole table
+WriteItem = Tuple[str, Optional[tuple]]
+
+
+class ApplyHaltedError(RuntimeError):
+    """A transaction could not be applied; nothing after it will be"""
+
+
+@dataclass
+class ApplyTransaction:
+    xid: int
+    commit_lsn: int
+    events: List[CDCEvent]
+    write_set: FrozenSet[WriteItem]
+    blockers: int = 0  # unfinished predecessors it conflicts with
+    dependents: List["ApplyTransaction"] = field(default_factory=list)
+    done: bool = False
+
+
+def build_write_set(events: List[CDCEvent]) -> FrozenSet[WriteItem]:
+    """Rows (table plus primary key) a transaction writes"""
+    items = set()
+    for event in events:
+        table = f"{event.schema}.{event.table}"
+        # key_columns is the catalog primary key (see PgOutputParser), so
+        # REPLICA IDENTITY FULL tables are still keyed per row
+        if not event.key_columns:
+            # Without a primary key the whole table is treated as written
+            items.add((table, None))
+            continue
+        for values in (event.old_values, event.new_values):
+            if values:
+                items.add((table, tuple(values.get(n) for n in event.key_columns)))
+    return frozenset(items)
+
+
+def _conflicts(a: FrozenSet[WriteItem], b: FrozenSet[WriteItem]) -> bool:
+    if not a.isdisjoint(b):
+        return True
+    whole_a = {table for table, key in a if key is None}
+    whole_b = {table for table, key in b if key is None}
+    return any(table in whole_a for table, _ in b) or any(
+        table in whole_b for table, _ in a
+    )
+
+
+def apply_events_sql(connection, events: List[CDCEvent]):
+    """
+    Default apply function: replay events as upserts and deletes.
+    Keyed tables are idempotent, so transactions replayed after a restart
+    are harmless. Tables without a primary key are at-least-once: a
+    replayed INSERT adds a duplicate row.
+    """
+    with connection.cursor() as cur:
+        for event in events:
+            target = sql.Identifier(event.schema, event.table)
+            keys = event.key_columns
+
+            if event.operation == "UPDATE" and not keys and not event.old_values:
+                raise ValueError(
+                    f"Cannot apply UPDATE on {event.schema}.{event.table}: "
+                    "no primary key and no old tuple"
+                )
+
+            # Without a key there is no upsert target, so an UPDATE becomes
+            # delete-old-row-then-insert, matching on every old-tuple column
+            replace_row = (
+                event.operation == "UPDATE"
+                and event.old_values
+                and event.new_values
+                and (
+                    not keys
+                    or any(
+                        event.old_values.get(k) != event.new_values.get(k)
+                        for k in keys
+                    )
+                )
+            )
+            if event.operation == "DELETE" or replace_row:
+                old = event.old_values or {}
+                match = keys or [n for n, v in old.items() if v is not UNCHANGED]
+                condition = sql.SQL(" AND ").join(
+                    sql.SQL("{} IS NOT DISTINCT FROM %s").format(sql.Identifier(n))
+                    for n in match
+                )
+                if keys:
+                    query = sql.SQL("DELETE FROM {} WHERE {}").format(
+                        target, condition
+                    )
+                else:
+                    # Remove exactly one of any identical duplicate rows
+                    query = sql.SQL(
+                        "DELETE FROM {0} WHERE ctid = "
+                        "(SELECT ctid FROM {0} WHERE {1} LIMIT 1)"
+                    ).format(target, condition)
+                cur.execute(query, [old.get(n) for n in match])
+
+            if event.operation in ("INSERT", "UPDATE") and event.new_values:
+                row = {n: v for n, v in event.new_values.items() if v is not UNCHANGED}
+                columns = list(row)
+                query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+                    target,
+                    sql.SQL(", ").join(map(sql.Identifier, columns)),
+                    sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+                )
+                if keys:
+                    query += sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {}").format(
+                        sql.SQL(", ").join(map(sql.Identifier, keys)),
+                        sql.SQL(", ").join(
+                            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(n))
+                            for n in columns
+                        ),
+                    )
+                cur.execute(query, list(row.values()))
+
+
+class TransactionApplyScheduler:
+    """
+    Applies committed source transactions to a target over a pool of
+    connections. Transactions with disjoint write sets run concurrently;
+    conflicting ones wait for their predecessors. The acknowledged LSN only
+    advances over a contiguous prefix of applied transactions, so after a
+    restart transactions that completed out of order are applied again
+    (see apply_events_sql for what that means per table).
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], Any],
+        apply_fn: Callable[[Any, List[CDCEvent]], None] = apply_events_sql,
+        pool_size: int = 4,
+        max_in_flight: int = 100,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,  # seconds, grows linearly per attempt
+        # Only connection-level errors can succeed on a retry
+        retryable: Tuple[type, ...] = (
+            psycopg2.OperationalError,
+            psycopg2.InterfaceError,
+        ),
+    ):
+        self.connection_factory = connection_factory
+        self.apply_fn = apply_fn
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retryable = retryable
+        self.retry_delay = retry_delay
+
+        self.pending: Dict[Optional[int], List[CDCEvent]] = {}  # xid -> events
+        self.in_flight: Deque[ApplyTransaction] = deque()  # commit order
+        self.ready: Queue = Queue()
+        self.acked_lsn = 0
+        self.failed: Optional[ApplyTransaction] = None
+        self.applied_count = 0
+        self.held_count = 0  # transactions that had to wait for a conflict
+        self.lock = threading.Lock()
+        self.slot_free = threading.Condition(self.lock)
+        self.threads: List[threading.Thread] = []
+        self.local = threading.local()  # per-worker target connection
+
+    def start(self):
+        for i in range(self.pool_size):
+            t = threading.Thread(
+                target=self._worker, name=f"apply-{i}", daemon=True
+            )
+            t.start()
+            self.threads.append(t)
+        logger.info(f"Apply scheduler started with {self.pool_size} connections")
+
+    def add(self, event: CDCEvent):
+        """Buffer an event until its transaction commits"""
+        self.pending.setdefault(event.xid, []).append(event)
+
+    def commit(self, xid: int, lsn: int):
+        """
+        Schedule a committed transaction, blocking while the window is full.
+        Raises ApplyHaltedError once a transaction has failed for good.
+        """
+        events = self.pending.pop(None, []) + self.pending.pop(xid, [])
+
+        with self.slot_free:
+            self.slot_free.wait_for(
+                lambda: self.failed is not None
+                or len(self.in_flight) < self.max_in_flight
+            )
+            if self.failed is not None:
+                raise ApplyHaltedError(
+                    f"Apply halted at xid {self.failed.xid} "
+                    f"(LSN {self.failed.commit_lsn})"
+                )
+
+            txn = ApplyTransaction(
+                xid=xid,
+                commit_lsn=lsn,
+                events=events,
+                write_set=build_write_set(events),
+            )
+            for earlier in self.in_flight:
+                if not earlier.done and _conflicts(earlier.write_set, txn.write_set):
+                    earlier.dependents.append(txn)
+                    txn.blockers += 1
+            self.in_flight.append(txn)
+
+            if not events:
+                # Nothing to apply, but the LSN may still need to advance
+                self._complete_locked(txn)
+            elif txn.blockers:
+                self.held_count += 1
+            else:
+                self.ready.put(txn)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "acked_lsn": self.acked_lsn,
+                "in_flight": len(self.in_flight),
+                "applied": self.applied_count,
+                "held": self.held_count,
+                "failed_xid": self.failed.xid if self.failed else None,
+            }
+
+    def _apply_with_retries(self, txn: ApplyTransaction) -> bool:
+        """Apply and commit one transaction on this worker's connection"""
+        for attempt in range(1, self.max_retries + 1):
+            connection = getattr(self.local, "connection", None)
+            try:
+                if connection is None or connection.closed:
+                    connection = self.local.connection = self.connection_factory()
+                self.apply_fn(connection, txn.events)
+                connection.commit()
+                return True
+            except Exception as e:
+                retry = isinstance(e, self.retryable) and attempt < self.max_retries
+                logger.error(
+                    f"Apply of xid {txn.xid} failed "
+                    f"(attempt {attempt}/{self.max_retries}): {e}"
+                )
+                try:
+                    if connection is not None and not connection.closed:
+                        connection.rollback()
+                except Exception:
+                    self.local.connection = None  # Reconnect on the next attempt
+
+                if not retry:
+                    return False
+                time.sleep(attempt * self.retry_delay)
+        return False
+
+    def _worker(self):
+        while True:
+            txn = self.ready.get()
+            if self.failed is not None:
+                continue  # Dispatched before the halt, must not apply now
+
+            if not self._apply_with_retries(txn):
+                # Stop dispatching and wake commit() so it raises instead of
+                # waiting for a window that will never drain
+                with self.slot_free:
+                    if self.failed is None:
+                        self.failed = txn
+                    self.slot_free.notify_all()
+                logger.error(f"Apply halted at xid {txn.xid} (LSN {txn.commit_lsn})")
+                continue
+
+            self._complete(txn)
+
+    def _complete(self, txn: ApplyTransaction):
+        with self.slot_free:
+            self.applied_count += 1
+            self._complete_locked(txn)
+
+    def _complete_locked(self, txn: ApplyTransaction):
+        txn.done = True
+
+        for dependent in txn.dependents:
+            dependent.blockers -= 1
+            if dependent.blockers == 0 and self.failed is None:
+                self.ready.put(dependent)
+
+        while self.in_flight and self.in_flight[0].done:
+            self.acked_lsn = self.in_flight.popleft().commit_lsn
+        self.slot_free.notify_all()
@@ -15,3 +15,24 @@ class CDCConfig:
     slot_name: str = os.environ.get("PG_SLOT_NAME", "python_cdc_slot")
     publication_name: str = os.environ.get("PG_PUBLICATION", "cdc_publication")
     offset_file: str = "offsets.json"
+    # Before-image cache for TOAST-unchanged columns (0 disables it)
+    row_cache_bytes: int = int(os.environ.get("CDC_ROW_CACHE_BYTES", 0))
+    # Comma separated "schema.table" list; empty caches every table
+    row_cache_tables: str = os.environ.get("CDC_ROW_CACHE_TABLES", "")
+    # Emit changed_columns for UPDATE events so sinks can ship deltas only
+    diff_updates: bool = os.environ.get("CDC_DIFF_UPDATES", "false").lower() == "true"
+    # Tables materialized in memory, comma separated "schema.table[:key+cols]";
+    # empty disables the state store
+    state_tables: str = os.environ.get("CDC_STATE_TABLES", "")
+    # Secondary indexes, comma separated "schema.table.column"
+    state_indexes: str = os.environ.get("CDC_STATE_INDEXES", "")
+    state_checkpoint_file: str = os.environ.get(
+        "CDC_STATE_CHECKPOINT_FILE", "state_checkpoint.json"
+    )
+    state_checkpoint_interval: int = int(
+        os.environ.get("CDC_STATE_CHECKPOINT_INTERVAL", 30)
+    )
+    # Target database for parallel transaction apply; empty disables it
+    apply_target_dsn: str = os.environ.get("CDC_APPLY_TARGET_DSN", "")
+    apply_workers: int = int(os.environ.get("CDC_APPLY_WORKERS", 4))
+    apply_max_in_flight: int = int(os.environ.get("CDC_APPLY_MAX_IN_FLIGHT", 100))
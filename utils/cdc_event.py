@@ -12,6 +12,11 @@ class CDCEvent:
     old_values: Optional[Dict[str, Any]] = None  # For UPDATE/DELETE
     new_values: Optional[Dict[str, Any]] = None  # For INSERT/UPDATE
     timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    # For UPDATE in diff mode: column -> {"old": ..., "new": ...}, keys always included
+    changed_columns: Optional[Dict[str, Dict[str, Any]]] = None
+    key_columns: List[str] = field(default_factory=list)  # Primary key, if known
+    xid: Optional[int] = None  # Source transaction id
+    commit_lsn: Optional[int] = None  # LSN of the transaction's commit record
 
     def to_dict(self) -> dict:
         return {
@@ -22,4 +27,23 @@ class CDCEvent:
             "old_values": self.old_values,
             "new_values": self.new_values,
             "timestamp": self.timestamp,
+            "changed_columns": self.changed_columns,
+            "key_columns": self.key_columns,
+            "xid": self.xid,
+            "commit_lsn": self.commit_lsn,
+        }
+
+    def to_delta_dict(self) -> dict:
+        """Compact record carrying only the changed (and key) columns"""
+        if self.changed_columns is None:
+            return self.to_dict()
+
+        return {
+            "operation": self.operation,
+            "schema": self.schema,
+            "table": self.table,
+            "key_columns": self.key_columns,
+            "changed_columns": self.changed_columns,
+            "commit_lsn": self.commit_lsn,
+            "timestamp": self.timestamp,
         }
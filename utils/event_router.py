@@ -0,0 +1,230 @@
+import fnmatch
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from utils.cdc_event import CDCEvent
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower value is serviced first
+PRIORITY_CLASSES = {"critical": 0, "normal": 1, "bulk": 2}
+
+
+@dataclass
+class HandlerSpec:
+    name: str
+    callback: Callable[[CDCEvent], None]
+    pool_size: int = 1
+    queue_size: int = 1000
+    priority: str = "normal"  # critical, normal or bulk
+    # Events buffered in memory once the queue is full, so a slow handler
+    # does not stall the replication thread for every other table
+    overflow_size: int = 100000
+
+
+@dataclass
+class HandlerMetrics:
+    enqueued: int = 0
+    processed: int = 0
+    failed: int = 0
+    overflowed: int = 0  # events buffered because the queue was full
+    blocked_puts: int = 0  # puts that stalled replication (overflow full too)
+    deferred: int = 0  # jobs held back for higher priority work
+    total_latency: float = 0.0  # seconds from enqueue to completion
+    max_latency: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+            "blocked_puts": self.blocked_puts,
+            "deferred": self.deferred,
+            "avg_latency_ms": round(
+                self.total_latency / self.processed * 1000, 3
+            )
+            if self.processed
+            else 0.0,
+            "max_latency_ms": round(self.max_latency * 1000, 3),
+        }
+
+
+@dataclass
+class _Handler:
+    spec: HandlerSpec
+    rank: int
+    queue: Queue
+    metrics: HandlerMetrics = field(default_factory=HandlerMetrics)
+    threads: List[threading.Thread] = field(default_factory=list)
+    overflow: Deque[tuple] = field(default_factory=deque)
+    # Guards metrics and overflow; notified when overflow space frees up
+    lock: threading.Condition = field(default_factory=threading.Condition)
+
+
+class EventRouter:
+    """Routes CDC events to named handler pools based on their table"""
+
+    def __init__(self, default_handlers: Optional[List[str]] = None):
+        self.handlers: Dict[str, _Handler] = {}
+        self.routes: List[Tuple[str, List[str]]] = []  # (pattern, handler names)
+        self.default_handlers = default_handlers or []
+        # (schema, table) -> handlers, compiled when a relation is announced
+        self.dispatch: Dict[Tuple[str, str], List[_Handler]] = {}
+        self.lock = threading.Lock()
+        self.priority_changed = threading.Condition()
+
+    def register_handler(self, spec: HandlerSpec):
+        """Register a named handler with its own queue and worker pool"""
+        if spec.priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {spec.priority}")
+
+        self.handlers[spec.name] = _Handler(
+            spec=spec,
+            rank=PRIORITY_CLASSES[spec.priority],
+            queue=Queue(maxsize=spec.queue_size),
+        )
+        self.dispatch.clear()
+
+    def add_route(self, pattern: str, handler_names: List[str]):
+        """Route tables matching a "schema.table" glob to the given handlers"""
+        for name in handler_names:
+            if name not in self.handlers:
+                raise ValueError(f"Unknown handler: {name}")
+
+        self.routes.append((pattern, handler_names))
+        self.dispatch.clear()
+
+    def compile_relation(self, schema: str, table: str) -> List[_Handler]:
+        """Build (or rebuild) the dispatch entry for a relation"""
+        qualified = f"{schema}.{table}"
+        names = self.default_handlers
+        for pattern, handler_names in self.routes:
+            if fnmatch.fnmatchcase(qualified, pattern):
+                names = handler_names
+                break
+
+        handlers = [self.handlers[name] for name in names]
+        with self.lock:
+            self.dispatch[(schema, table)] = handlers
+
+        logger.info(f"Routing {qualified} -> {', '.join(names) or '(dropped)'}")
+        return handlers
+
+    def route(self, event: CDCEvent):
+        """
+        Enqueue an event on every handler its table is routed to.
+        A full handler queue spills into that handler's overflow buffer, so
+        only its route falls behind. The replication thread blocks only when
+        the overflow buffer is full as well (counted in blocked_puts).
+        """
+        handlers = self.dispatch.get((event.schema, event.table))
+        if handlers is None:
+            handlers = self.compile_relation(event.schema, event.table)
+
+        item = (time.monotonic(), event)
+        for handler in handlers:
+            with handler.lock:
+                handler.metrics.enqueued += 1
+                # Keep order: once events overflow, new ones queue behind them
+                if not handler.overflow and not handler.queue.full():
+                    handler.queue.put_nowait(item)
+                    continue
+
+                if len(handler.overflow) >= handler.spec.overflow_size:
+                    handler.metrics.blocked_puts += 1
+                    handler.lock.wait_for(
+                        lambda: len(handler.overflow) < handler.spec.overflow_size
+                    )
+                handler.overflow.append(item)
+                handler.metrics.overflowed += 1
+
+    def start(self):
+        """Start the worker pools of all registered handlers"""
+        for handler in self.handlers.values():
+            for i in range(handler.spec.pool_size):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(handler,),
+                    name=f"{handler.spec.name}-{i}",
+                    daemon=True,
+                )
+                t.start()
+                handler.threads.append(t)
+
+            logger.info(
+                f"Handler '{handler.spec.name}' started with "
+                f"{handler.spec.pool_size} workers ({handler.spec.priority})"
+            )
+
+    def metrics(self) -> dict:
+        return {
+            name: {
+                "priority": handler.spec.priority,
+                "pool_size": handler.spec.pool_size,
+                "queue_depth": handler.queue.qsize(),
+                "queue_size": handler.spec.queue_size,
+                "overflow_depth": len(handler.overflow),
+                **self._metrics_snapshot(handler),
+            }
+            for name, handler in self.handlers.items()
+        }
+
+    def _metrics_snapshot(self, handler: _Handler) -> dict:
+        with handler.lock:
+            return handler.metrics.to_dict()
+
+    def _higher_priority_pending(self, rank: int) -> bool:
+        return any(
+            h.rank < rank and h.queue.unfinished_tasks > 0
+            for h in self.handlers.values()
+        )
+
+    def _refill(self, handler: _Handler):
+        """Move overflowed events into the queue as space frees up"""
+        with handler.lock:
+            while handler.overflow and not handler.queue.full():
+                handler.queue.put_nowait(handler.overflow.popleft())
+            handler.lock.notify_all()
+
+    def _worker(self, handler: _Handler):
+        while True:
+            enqueued_at, event = handler.queue.get()
+            self._refill(handler)
+
+            # Lower priority classes only start new work once every higher
+            # priority queue is drained
+            if self._higher_priority_pending(handler.rank):
+                with handler.lock:
+                    handler.metrics.deferred += 1
+                with self.priority_changed:
+                    while self._higher_priority_pending(handler.rank):
+                        self.priority_changed.wait(timeout=0.1)
+
+            failed = False
+            try:
+                handler.spec.callback(event)
+            except Exception as e:
+                failed = True
+                logger.error(f"Handler '{handler.spec.name}' failed: {e}")
+            finally:
+                latency = time.monotonic() - enqueued_at
+                with handler.lock:
+                    if failed:
+                        handler.metrics.failed += 1
+                    else:
+                        handler.metrics.processed += 1
+                    handler.metrics.total_latency += latency
+                    handler.metrics.max_latency = max(
+                        handler.metrics.max_latency, latency
+                    )
+                handler.queue.task_done()
+
+                if handler.rank < max(PRIORITY_CLASSES.values()):
+                    with self.priority_changed:
+                        self.priority_changed.notify_all()
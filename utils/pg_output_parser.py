@@ -1,7 +1,8 @@
 import struct
 import logging
-from typing import Optional, Dict
+from typing import Any, Callable, Optional, Dict, List
 from utils.cdc_event import CDCEvent
+from utils.row_image_cache import UNCHANGED, RowImageCache
 
 logger = logging.getLogger(__name__)
 
@@ -9,8 +10,31 @@ logger = logging.getLogger(__name__)
 class PgOutputParser:
     """Parser for PostgreSQL pgoutput logical replication protocol"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        row_cache: Optional[RowImageCache] = None,
+        row_loader: Optional[
+            Callable[[str, str, List[str], Dict[str, Any]], Optional[Dict[str, Any]]]
+        ] = None,
+        diff_updates: bool = False,
+        primary_key_loader: Optional[Callable[[str, str], Optional[List[str]]]] = None,
+    ):
         self.relations: Dict[int, dict] = {}  # relation_id -> relation info
+        # Optional (schema, table) -> primary key columns catalog lookup
+        self.primary_key_loader = primary_key_loader
+        # Optional before-image cache used to fill TOAST-unchanged columns
+        self.row_cache = row_cache
+        # Optional (schema, table, columns, key_values) -> row lookup for cache misses
+        self.row_loader = row_loader
+        # Compute changed_columns for UPDATE events
+        self.diff_updates = diff_updates
+        # Optional (schema, table) callback fired for every relation message
+        self.on_relation: Optional[Callable[[str, str], None]] = None
+        # Optional (xid, commit_lsn) callback fired for every commit message
+        self.on_commit: Optional[Callable[[int, int], None]] = None
+        # Transaction currently being decoded
+        self.xid: Optional[int] = None
+        self.commit_lsn: Optional[int] = None
 
     def parse_message(self, payload: bytes) -> Optional[CDCEvent]:
         """Parse a pgoutput protocol message"""
@@ -30,14 +54,34 @@ class PgOutputParser:
         elif msg_type == "D":  # Delete
             return self._parse_delete(data)
         elif msg_type == "B":  # Begin
-            logger.debug("Transaction BEGIN")
+            self._parse_begin(data)
             return None
         elif msg_type == "C":  # Commit
-            logger.debug("Transaction COMMIT")
+            self._parse_commit(data)
             return None
 
         return None
 
+    def _parse_begin(self, data: bytes):
+        """Parse BEGIN message"""
+        # Final LSN (8 bytes), commit timestamp (8 bytes), xid (4 bytes)
+        final_lsn, _, xid = struct.unpack(">QqI", data[:20])
+        self.xid = xid
+        self.commit_lsn = final_lsn
+        logger.debug(f"Transaction BEGIN xid={xid}")
+
+    def _parse_commit(self, data: bytes):
+        """Parse COMMIT message"""
+        # Flags (1 byte), commit LSN (8 bytes), end LSN (8 bytes), timestamp
+        _, commit_lsn, _ = struct.unpack(">BQQ", data[:17])
+        xid = self.xid
+        self.xid = None
+        self.commit_lsn = None
+        logger.debug(f"Transaction COMMIT xid={xid}")
+
+        if self.on_commit and xid is not None:
+            self.on_commit(xid, commit_lsn)
+
     def _parse_relation(self, data: bytes):
         """Parse relation (table) metadata message"""
         pos = 0
@@ -85,17 +129,29 @@ class PgOutputParser:
 
             columns.append({"name": col_name, "type_id": type_id, "flags": flags})
 
+        previous = self.relations.get(relation_id)
+        if self.row_cache and previous and previous["columns"] != columns:
+            self.row_cache.invalidate_table(previous["schema"], previous["table"])
+
+        primary_key = None
+        if self.primary_key_loader:
+            primary_key = self.primary_key_loader(namespace, relation_name)
+
         self.relations[relation_id] = {
             "schema": namespace,
             "table": relation_name,
             "columns": columns,
             "replica_identity": replica_identity,
+            "primary_key": primary_key,
         }
 
         logger.info(
             f"Registered relation: {namespace}.{relation_name} with {num_columns} columns"
         )
 
+        if self.on_relation:
+            self.on_relation(namespace, relation_name)
+
     def _parse_tuple_data(self, data: bytes, pos: int, columns: list) -> tuple:
         """Parse tuple data and return (values_dict, new_position)"""
         # Number of columns (2 bytes)
@@ -110,7 +166,7 @@ class PgOutputParser:
             if col_type == "n":  # NULL
                 values[columns[i]["name"]] = None
             elif col_type == "u":  # Unchanged (for updates)
-                values[columns[i]["name"]] = "[unchanged]"
+                values[columns[i]["name"]] = UNCHANGED
             elif col_type == "t":  # Text
                 # Length (4 bytes)
                 length = struct.unpack(">I", data[pos : pos + 4])[0]
@@ -127,6 +183,90 @@ class PgOutputParser:
 
         return values, pos
 
+    def _key_columns(self, relation: dict) -> List[str]:
+        """Names of the primary key columns, empty if unknown"""
+        if relation["primary_key"]:
+            return relation["primary_key"]
+        # With REPLICA IDENTITY FULL every column is flagged as key, so the
+        # flags say nothing about the primary key without the catalog lookup.
+        if relation["replica_identity"] == "f":
+            return []
+        return [c["name"] for c in relation["columns"] if c["flags"] & 1]
+
+    def _row_key(self, relation: dict, values: Optional[dict]) -> Optional[tuple]:
+        """Build the cache key from replica identity columns, if usable"""
+        key_columns = self._key_columns(relation)
+        if not values or not key_columns:
+            return None
+
+        key = tuple(values.get(name) for name in key_columns)
+        if any(value is None or value is UNCHANGED for value in key):
+            return None
+        return key
+
+    def _cached_image(
+        self, relation: dict, key: Optional[tuple]
+    ) -> Optional[Dict[str, Any]]:
+        """Row image cached from earlier events, a true before-image"""
+        if key is None or not self.row_cache:
+            return None
+        if not self.row_cache.enabled_for(relation["schema"], relation["table"]):
+            return None
+        return self.row_cache.get(relation["schema"], relation["table"], key)
+
+    def _load_image(self, relation: dict, new_values: dict) -> Optional[Dict[str, Any]]:
+        """
+        Current row from the source. It may already include this or later
+        changes, so it is only good for filling unchanged (TOAST) columns.
+        """
+        if not self.row_loader or not self.row_cache:
+            return None
+        if not self.row_cache.enabled_for(relation["schema"], relation["table"]):
+            return None
+
+        key_columns = self._key_columns(relation)
+        if not key_columns:
+            return None
+        return self.row_loader(
+            relation["schema"],
+            relation["table"],
+            [c["name"] for c in relation["columns"]],
+            {name: new_values[name] for name in key_columns},
+        )
+
+    def _fill_unchanged(self, new_values: dict, sources: List[dict]):
+        """Replace unchanged (TOAST) placeholders with before-image values"""
+        missing = [name for name, value in new_values.items() if value is UNCHANGED]
+        for name in missing:
+            for source in sources:
+                value = source.get(name, UNCHANGED)
+                if value is not UNCHANGED:
+                    new_values[name] = value
+                    break
+
+    def _diff_columns(
+        self,
+        relation: dict,
+        before: Dict[str, Any],
+        new_values: dict,
+        unchanged: set,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Columns whose value changed, plus the key columns, as old/new pairs"""
+        # Without a known primary key, include every replica identity column
+        key_columns = self._key_columns(relation) or [
+            c["name"] for c in relation["columns"] if c["flags"] & 1
+        ]
+        changed = {}
+        for name, value in new_values.items():
+            if name not in key_columns:
+                if name in unchanged:
+                    continue
+                # Without a before-image the column is reported as changed
+                if name in before and before[name] == value:
+                    continue
+            changed[name] = {"old": before.get(name), "new": value}
+        return changed
+
     def _parse_insert(self, data: bytes) -> Optional[CDCEvent]:
         """Parse INSERT message"""
         pos = 0
@@ -147,11 +287,21 @@ class PgOutputParser:
 
         new_values, _ = self._parse_tuple_data(data, pos, relation["columns"])
 
+        if self.row_cache:
+            key = self._row_key(relation, new_values)
+            if key is not None:
+                self.row_cache.put(
+                    relation["schema"], relation["table"], key, new_values
+                )
+
         return CDCEvent(
             operation="INSERT",
             schema=relation["schema"],
             table=relation["table"],
             columns=[c["name"] for c in relation["columns"]],
+            key_columns=self._key_columns(relation),
+            xid=self.xid,
+            commit_lsn=self.commit_lsn,
             new_values=new_values,
         )
 
@@ -172,9 +322,17 @@ class PgOutputParser:
 
         # Check for old tuple ('O' or 'K')
         tuple_type = chr(data[pos])
+        old_image = None
         if tuple_type in ("O", "K"):
             pos += 1
             old_values, pos = self._parse_tuple_data(data, pos, relation["columns"])
+            # A 'K' tuple carries only the identity columns, the rest are NULL
+            identity = {c["name"] for c in relation["columns"] if c["flags"] & 1}
+            old_image = {
+                n: v
+                for n, v in old_values.items()
+                if v is not UNCHANGED and (tuple_type == "O" or n in identity)
+            }
             tuple_type = chr(data[pos])
 
         # New tuple ('N')
@@ -182,13 +340,50 @@ class PgOutputParser:
             pos += 1
             new_values, _ = self._parse_tuple_data(data, pos, relation["columns"])
 
+        changed_columns = None
+        if new_values:
+            key = self._row_key(relation, new_values)
+            unchanged = {n for n, v in new_values.items() if v is UNCHANGED}
+            cached = self._cached_image(relation, key)
+            sources = [s for s in (old_image, cached) if s is not None]
+            if unchanged and cached is None:
+                loaded = self._load_image(relation, new_values)
+                if loaded is not None:
+                    sources.append(loaded)
+            self._fill_unchanged(new_values, sources)
+
+            if self.diff_updates:
+                # Only true before-images count; the old tuple, when sent, is
+                # more current than the cache. Columns with no before-image
+                # are reported as changed.
+                before = dict(cached or {})
+                before.update(old_image or {})
+                changed_columns = self._diff_columns(
+                    relation, before, new_values, unchanged
+                )
+
+            if self.row_cache and key is not None:
+                # A 'K' old tuple means the key itself changed
+                old_key = self._row_key(relation, old_values)
+                if old_key is not None and old_key != key:
+                    self.row_cache.discard(
+                        relation["schema"], relation["table"], old_key
+                    )
+                self.row_cache.put(
+                    relation["schema"], relation["table"], key, new_values
+                )
+
         return CDCEvent(
             operation="UPDATE",
             schema=relation["schema"],
             table=relation["table"],
             columns=[c["name"] for c in relation["columns"]],
+            key_columns=self._key_columns(relation),
+            xid=self.xid,
+            commit_lsn=self.commit_lsn,
             old_values=old_values,
             new_values=new_values,
+            changed_columns=changed_columns,
         )
 
     def _parse_delete(self, data: bytes) -> Optional[CDCEvent]:
@@ -209,10 +404,18 @@ class PgOutputParser:
 
         old_values, _ = self._parse_tuple_data(data, pos, relation["columns"])
 
+        if self.row_cache:
+            key = self._row_key(relation, old_values)
+            if key is not None:
+                self.row_cache.discard(relation["schema"], relation["table"], key)
+
         return CDCEvent(
             operation="DELETE",
             schema=relation["schema"],
             table=relation["table"],
             columns=[c["name"] for c in relation["columns"]],
+            key_columns=self._key_columns(relation),
+            xid=self.xid,
+            commit_lsn=self.commit_lsn,
             old_values=old_values,
         )
@@ -1,15 +1,20 @@
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import LogicalReplicationConnection
-from typing import Callable, Optional
+from typing import Any, Callable, Dict, List, Optional
 import logging
+import time
 
 from dotenv import load_dotenv
 from queue import Queue
 
 
+from utils.apply_scheduler import ApplyHaltedError, TransactionApplyScheduler
 from utils.cdc_config import CDCConfig
 from utils.cdc_event import CDCEvent
 from utils.pg_output_parser import PgOutputParser
+from utils.row_image_cache import RowImageCache
+from utils.state_store import MaterializedStateStore, StateStoreError
 
 EVENT_QUEUE = Queue(maxsize=1000)  # backpressure protection
 
@@ -26,9 +31,92 @@ class PostgresCDCConsumer:
         self.config = config
         self.connection: Optional[psycopg2.extensions.connection] = None
         self.cursor = None
-        self.parser = PgOutputParser()
+        self.lookup_connection: Optional[psycopg2.extensions.connection] = None
+        self.row_cache: Optional[RowImageCache] = None
+        if config.row_cache_bytes > 0:
+            tables = [
+                t.strip() for t in config.row_cache_tables.split(",") if t.strip()
+            ]
+            self.row_cache = RowImageCache(config.row_cache_bytes, tables)
+        self.parser = PgOutputParser(
+            row_cache=self.row_cache,
+            row_loader=self.fetch_row if self.row_cache else None,
+            diff_updates=config.diff_updates,
+            primary_key_loader=self.fetch_primary_key,
+        )
+        self.state_store: Optional[MaterializedStateStore] = None
+        self.last_checkpoint = time.monotonic()
+        if config.state_tables:
+            self.state_store = self._build_state_store()
+            self.state_store.restore()
+        self.apply_scheduler: Optional[TransactionApplyScheduler] = None
+        if config.apply_target_dsn:
+            self.apply_scheduler = TransactionApplyScheduler(
+                lambda: psycopg2.connect(config.apply_target_dsn),
+                pool_size=config.apply_workers,
+                max_in_flight=config.apply_max_in_flight,
+            )
+        self.parser.on_commit = self._on_commit
         self.running = False
 
+    def _build_state_store(self) -> MaterializedStateStore:
+        """Build the in-memory state store from CDC_STATE_* settings"""
+        tables = {}
+        for entry in self.config.state_tables.split(","):
+            if not entry.strip():
+                continue
+            name, _, keys = entry.strip().partition(":")
+            if keys:
+                tables[name] = keys.split("+")
+                continue
+
+            # Resolve the key now rather than dropping every event later
+            # (e.g. REPLICA IDENTITY FULL tables carry no usable key flags)
+            schema, _, table = name.partition(".")
+            primary_key = self.fetch_primary_key(schema, table)
+            if not primary_key:
+                raise ValueError(
+                    f"State store table {name} has no primary key; "
+                    f"configure one as {name}:col1+col2 in CDC_STATE_TABLES"
+                )
+            tables[name] = primary_key
+
+        indexes = {}
+        for entry in self.config.state_indexes.split(","):
+            if not entry.strip():
+                continue
+            name, _, column = entry.strip().rpartition(".")
+            if name not in tables:
+                raise ValueError(
+                    f"Index {entry.strip()} is on a table not in CDC_STATE_TABLES"
+                )
+            schema, _, table = name.partition(".")
+            columns = self.fetch_columns(schema, table)
+            if columns is not None and column not in columns:
+                raise ValueError(
+                    f"Index {entry.strip()}: {name} has no column {column}"
+                )
+            indexes.setdefault(name, []).append(column)
+
+        return MaterializedStateStore(
+            tables, indexes, checkpoint_file=self.config.state_checkpoint_file
+        )
+
+    def _on_commit(self, xid: int, lsn: int):
+        """Hand a committed transaction to the apply scheduler and state store"""
+        # The scheduler goes first so a state store failure can never leave
+        # the transaction unscheduled while later commits move acked_lsn on
+        if self.apply_scheduler:
+            self.apply_scheduler.commit(xid, lsn)
+
+        if self.state_store:
+            self.state_store.commit(xid, lsn)
+
+            now = time.monotonic()
+            if now - self.last_checkpoint >= self.config.state_checkpoint_interval:
+                self.state_store.checkpoint()
+                self.last_checkpoint = now
+
     def connect(self):
         """Establish a logical replication connection"""
         self.connection = psycopg2.connect(
@@ -44,6 +132,98 @@ class PostgresCDCConsumer:
             f"Connected to PostgreSQL at {self.config.host}:{self.config.port}/{self.config.database}"
         )
 
+    def _lookup_cursor(self):
+        """Cursor on a regular (non-replication) connection, opened lazily"""
+        if self.lookup_connection is None or self.lookup_connection.closed:
+            self.lookup_connection = psycopg2.connect(
+                host=self.config.host,
+                port=self.config.port,
+                user=self.config.user,
+                password=self.config.password,
+                database=self.config.database,
+            )
+            self.lookup_connection.autocommit = True
+        return self.lookup_connection.cursor()
+
+    def fetch_primary_key(self, schema: str, table: str) -> Optional[List[str]]:
+        """Primary key columns of a table from the catalog, None if it has none"""
+        try:
+            with self._lookup_cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT a.attname
+                    FROM pg_index i
+                    JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, n)
+                        ON true
+                    JOIN pg_attribute a
+                        ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                    WHERE i.indrelid = (quote_ident(%s) || '.' || quote_ident(%s))::regclass
+                      AND i.indisprimary
+                    ORDER BY k.n
+                    """,
+                    (schema, table),
+                )
+                columns = [row[0] for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Error looking up primary key of {schema}.{table}: {e}")
+            return None
+
+        return columns or None
+
+    def fetch_columns(self, schema: str, table: str) -> Optional[List[str]]:
+        """Column names of a table from the catalog, None if the lookup fails"""
+        try:
+            with self._lookup_cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT attname
+                    FROM pg_attribute
+                    WHERE attrelid = (quote_ident(%s) || '.' || quote_ident(%s))::regclass
+                      AND attnum > 0 AND NOT attisdropped
+                    ORDER BY attnum
+                    """,
+                    (schema, table),
+                )
+                return [row[0] for row in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Error looking up columns of {schema}.{table}: {e}")
+            return None
+
+    def fetch_row(
+        self,
+        schema: str,
+        table: str,
+        columns: List[str],
+        key_values: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        """Look up the current row image on a regular connection (cache miss)"""
+        try:
+            # Cast to text so values match the pgoutput text representation
+            query = sql.SQL("SELECT {} FROM {}.{} WHERE {}").format(
+                sql.SQL(", ").join(
+                    sql.SQL("{}::text").format(sql.Identifier(name))
+                    for name in columns
+                ),
+                sql.Identifier(schema),
+                sql.Identifier(table),
+                sql.SQL(" AND ").join(
+                    sql.SQL("{}::text = %s").format(sql.Identifier(name))
+                    for name in key_values
+                ),
+            )
+            with self._lookup_cursor() as cur:
+                cur.execute(query, list(key_values.values()))
+                result = cur.fetchone()
+        except Exception as e:
+            logger.error(f"Error looking up row in {schema}.{table}: {e}")
+            return None
+
+        if result is None:
+            return None
+
+        # The parser caches the merged row once the update is decoded
+        return dict(zip(columns, result))
+
     def create_replication_slot(self):
         """Create replication slot if it doesn't exist"""
         try:
@@ -69,6 +249,9 @@ class PostgresCDCConsumer:
         """Start consuming CDC events"""
         self.running = True
 
+        if self.apply_scheduler:
+            self.apply_scheduler.start()
+
         # Start replication with pgoutput plugin
         self.cursor.start_replication(
             slot_name=self.config.slot_name,
@@ -93,11 +276,28 @@ class PostgresCDCConsumer:
                 event = self.parser.parse_message(payload)
 
                 if event:
+                    if self.state_store:
+                        self.state_store.apply(event)
+                    if self.apply_scheduler:
+                        self.apply_scheduler.add(event)
                     callback(event)
 
-                # Send feedback to PostgreSQL (acknowledges the message)
-                msg.cursor.send_feedback(flush_lsn=msg.data_start)
+                # Send feedback to PostgreSQL (acknowledges the message).
+                # With a state store, WAL is kept until it is checkpointed, and
+                # with parallel apply until every earlier transaction is applied,
+                # so a restart can replay whatever was not made durable.
+                flush_lsn = msg.data_start
+                if self.state_store:
+                    flush_lsn = min(flush_lsn, self.state_store.checkpoint_lsn)
+                if self.apply_scheduler:
+                    flush_lsn = min(flush_lsn, self.apply_scheduler.acked_lsn)
+                msg.cursor.send_feedback(flush_lsn=flush_lsn)
 
+            except (ApplyHaltedError, StateStoreError):
+                # A committed transaction was not applied; stop rather than
+                # ack past it so a restart replays it
+                self.running = False
+                raise
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
                 import traceback
@@ -116,8 +316,12 @@ class PostgresCDCConsumer:
     def close(self):
         """Close the connection"""
         self.running = False
+        if self.state_store:
+            self.state_store.checkpoint()
         if self.cursor:
             self.cursor.close()
+        if self.lookup_connection:
+            self.lookup_connection.close()
         if self.connection:
             self.connection.close()
         logger.info("Connection closed")
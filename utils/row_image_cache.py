@@ -0,0 +1,106 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Unchanged(str):
+    """
+    Marker for TOAST columns the server did not resend. It serializes as
+    "[unchanged]", but must be tested with `is` so a real column value of
+    "[unchanged]" is never mistaken for it.
+    """
+
+
+UNCHANGED = _Unchanged("[unchanged]")
+
+# Rough per-entry overhead (dict, tuple and OrderedDict bookkeeping)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class RowImageCache:
+    """Byte-bounded LRU cache of the latest row image, keyed by primary key"""
+
+    def __init__(self, max_bytes: int, tables: Optional[Iterable[str]] = None):
+        self.max_bytes = max_bytes
+        # Optional "schema.table" allow-list; None caches every table
+        self.tables = set(tables) if tables else None
+        self.entries: "OrderedDict[tuple, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled_for(self, schema: str, table: str) -> bool:
+        """Check whether rows of the given table should be cached"""
+        return self.tables is None or f"{schema}.{table}" in self.tables
+
+    def get(self, schema: str, table: str, key: tuple) -> Optional[Dict[str, Any]]:
+        """Return the cached row image, or None on a miss"""
+        entry = self.entries.get((schema, table, key))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end((schema, table, key))
+        self.hits += 1
+        return entry[0]
+
+    def put(self, schema: str, table: str, key: tuple, row: Dict[str, Any]):
+        """Store a full row image, evicting least recently used rows if needed"""
+        if not self.enabled_for(schema, table):
+            return
+
+        # Never cache placeholders, only real column values
+        if any(value is UNCHANGED for value in row.values()):
+            return
+
+        cache_key = (schema, table, key)
+        size = self._estimate_size(key, row)
+        if size > self.max_bytes:
+            self.discard(schema, table, key)
+            return
+
+        self.discard(schema, table, key)
+        self.entries[cache_key] = (dict(row), size)
+        self.size_bytes += size
+
+        while self.size_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+
+    def discard(self, schema: str, table: str, key: tuple):
+        """Remove a row image (e.g. after a DELETE)"""
+        entry = self.entries.pop((schema, table, key), None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+
+    def invalidate_table(self, schema: str, table: str):
+        """Drop every cached row of a table (e.g. after a schema change)"""
+        stale = [k for k in self.entries if k[0] == schema and k[1] == table]
+        for cache_key in stale:
+            self.size_bytes -= self.entries.pop(cache_key)[1]
+
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached rows of {schema}.{table}")
+
+    def stats(self) -> dict:
+        return {
+            "rows": len(self.entries),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    @staticmethod
+    def _estimate_size(key: tuple, row: Dict[str, Any]) -> int:
+        size = ENTRY_OVERHEAD_BYTES
+        for value in key:
+            size += len(str(value))
+        for name, value in row.items():
+            size += len(name) + (len(value) if isinstance(value, str) else 8)
+        return size
@@ -0,0 +1,370 @@
+import bisect
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.cdc_event import CDCEvent
+from utils.row_image_cache import UNCHANGED
+
+logger = logging.getLogger(__name__)
+
+
+
+class StateStoreError(RuntimeError):
+    """A committed transaction could not be applied to the state store"""
+
+
+# (columns, key columns, key -> final row or None if deleted)
+TableChanges = Tuple[List[str], List[str], Dict[tuple, Optional[dict]]]
+
+
+def _sort_key(key: tuple) -> tuple:
+    """Order key values numerically when they look like integers"""
+    result = []
+    for value in key:
+        try:
+            result.append((0, int(value), ""))
+        except (TypeError, ValueError):
+            result.append((1, 0, str(value)))
+    return tuple(result)
+
+
+class TableState:
+    """Slotted row storage for one relation, keyed by primary key"""
+
+    def __init__(
+        self,
+        columns: List[str],
+        key_columns: List[str],
+        indexed_columns: Optional[List[str]] = None,
+    ):
+        self.columns = list(columns)
+        self.key_columns = list(key_columns)
+        self.slots: List[Optional[list]] = []  # row values in column order
+        self.free_slots: List[int] = []
+        self.primary: Dict[tuple, int] = {}  # key -> slot
+        # column -> value -> slots
+        self.secondary: Dict[str, Dict[Any, set]] = {}
+        for name in indexed_columns or []:
+            if name in self.columns:
+                self.secondary[name] = {}
+            else:
+                logger.warning(f"Index on unknown column '{name}' ignored")
+        self._sorted_keys: Optional[List[Tuple[tuple, tuple]]] = None
+
+    def __len__(self) -> int:
+        return len(self.primary)
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        slot = self.primary.get(key)
+        if slot is None:
+            return None
+        return dict(zip(self.columns, self.slots[slot]))
+
+    def lookup(self, column: str, value: Any) -> List[Dict[str, Any]]:
+        """Rows whose indexed column equals value"""
+        if column not in self.secondary:
+            raise KeyError(f"Column '{column}' is not indexed")
+        return [
+            dict(zip(self.columns, self.slots[slot]))
+            for slot in self.secondary[column].get(value, ())
+        ]
+
+    def range(
+        self, low: Optional[tuple] = None, high: Optional[tuple] = None
+    ) -> List[Dict[str, Any]]:
+        """Rows with low <= key <= high, in key order"""
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted((_sort_key(k), k) for k in self.primary)
+
+        start = 0
+        if low is not None:
+            start = bisect.bisect_left(self._sorted_keys, (_sort_key(low),))
+        rows = []
+        high_key = _sort_key(high) if high is not None else None
+        for sort_key, key in self._sorted_keys[start:]:
+            if high_key is not None and sort_key > high_key:
+                break
+            rows.append(self.get(key))
+        return rows
+
+    def upsert(self, row: Dict[str, Any]):
+        key = tuple(row.get(name) for name in self.key_columns)
+        values = [row.get(name) for name in self.columns]
+
+        slot = self.primary.get(key)
+        if slot is None:
+            slot = self.free_slots.pop() if self.free_slots else len(self.slots)
+            if slot == len(self.slots):
+                self.slots.append(None)
+            self.primary[key] = slot
+            self._sorted_keys = None
+        else:
+            self._unindex(slot)
+
+        self.slots[slot] = values
+        self._index(slot)
+
+    def delete(self, key: tuple):
+        slot = self.primary.pop(key, None)
+        if slot is None:
+            return
+        self._unindex(slot)
+        self.slots[slot] = None
+        self.free_slots.append(slot)
+        self._sorted_keys = None
+
+    def reshape(self, columns: List[str]):
+        """Adapt stored rows to a new column list (schema change)"""
+        if columns == self.columns:
+            return
+        positions = [
+            self.columns.index(name) if name in self.columns else None
+            for name in columns
+        ]
+        for slot, values in enumerate(self.slots):
+            if values is not None:
+                self.slots[slot] = [
+                    values[pos] if pos is not None else None for pos in positions
+                ]
+        self.columns = list(columns)
+        self.secondary = {
+            name: index for name, index in self.secondary.items() if name in columns
+        }
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return [self.get(key) for key in self.primary]
+
+    def _index(self, slot: int):
+        for name, index in self.secondary.items():
+            value = self.slots[slot][self.columns.index(name)]
+            index.setdefault(value, set()).add(slot)
+
+    def _unindex(self, slot: int):
+        for name, index in self.secondary.items():
+            value = self.slots[slot][self.columns.index(name)]
+            slots = index.get(value)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del index[value]
+
+
+@dataclass
+class StateSnapshot:
+    lsn: int
+    tables: Dict[str, List[Dict[str, Any]]]  # "schema.table" -> rows
+
+
+class MaterializedStateStore:
+    """In-memory current state of selected tables, maintained from the CDC stream"""
+
+    def __init__(
+        self,
+        tables: Dict[str, Optional[List[str]]],
+        indexes: Optional[Dict[str, List[str]]] = None,
+        checkpoint_file: Optional[str] = None,
+    ):
+        # "schema.table" -> key columns (None falls back to the event's key)
+        self.table_keys = tables
+        self.indexes = indexes or {}
+        self.checkpoint_file = checkpoint_file
+        self.tables: Dict[str, TableState] = {}
+        self.pending: Dict[int, List[CDCEvent]] = {}  # xid -> buffered events
+        self.applied_lsn = 0
+        self.checkpoint_lsn = 0
+        self.lock = threading.Lock()
+        self.applied = threading.Condition(self.lock)
+
+    def apply(self, event: CDCEvent):
+        """Buffer an event until its transaction commits"""
+        qualified = f"{event.schema}.{event.table}"
+        if qualified not in self.table_keys:
+            return
+        if event.commit_lsn is not None and event.commit_lsn <= self.applied_lsn:
+            return  # Already contained in the restored checkpoint
+        self.pending.setdefault(event.xid, []).append(event)
+
+    def commit(self, xid: int, lsn: int):
+        """Apply a committed transaction atomically and advance the LSN"""
+        # Events decoded outside a BEGIN/COMMIT pair are applied with any commit
+        events = self.pending.pop(None, []) + self.pending.pop(xid, [])
+
+        # Work out the final rows first so a bad event leaves the store
+        # untouched (and the transaction pending) instead of half applied
+        try:
+            changes = self._prepare_changes(events)
+        except Exception as e:
+            self.pending[xid] = events + self.pending.get(xid, [])
+            raise StateStoreError(f"State store failed at xid {xid}: {e}") from e
+
+        with self.applied:
+            for qualified, (columns, key_columns, rows) in changes.items():
+                state = self.tables.get(qualified)
+                if state is None:
+                    state = TableState(
+                        columns, key_columns, self.indexes.get(qualified)
+                    )
+                    self.tables[qualified] = state
+                state.reshape(columns)
+                for key, row in rows.items():
+                    if row is None:
+                        state.delete(key)
+                    else:
+                        state.upsert(row)
+            if lsn > self.applied_lsn:
+                self.applied_lsn = lsn
+            self.applied.notify_all()
+
+    def get(self, schema: str, table: str, key: tuple) -> Optional[Dict[str, Any]]:
+        """Point lookup by primary key"""
+        with self.lock:
+            state = self.tables.get(f"{schema}.{table}")
+            return state.get(key) if state else None
+
+    def lookup(
+        self, schema: str, table: str, column: str, value: Any
+    ) -> List[Dict[str, Any]]:
+        """Lookup through a secondary index"""
+        with self.lock:
+            state = self.tables.get(f"{schema}.{table}")
+            return state.lookup(column, value) if state else []
+
+    def range(
+        self,
+        schema: str,
+        table: str,
+        low: Optional[tuple] = None,
+        high: Optional[tuple] = None,
+    ) -> List[Dict[str, Any]]:
+        """Range lookup by primary key, inclusive on both ends"""
+        with self.lock:
+            state = self.tables.get(f"{schema}.{table}")
+            return state.range(low, high) if state else []
+
+    def snapshot(
+        self, min_lsn: Optional[int] = None, timeout: Optional[float] = None
+    ) -> StateSnapshot:
+        """
+        Consistent copy of every table as of a single commit LSN.
+        If min_lsn is given, waits until the store has applied it.
+        """
+        with self.applied:
+            if min_lsn is not None:
+                if not self.applied.wait_for(
+                    lambda: self.applied_lsn >= min_lsn, timeout=timeout
+                ):
+                    raise TimeoutError(
+                        f"State store has not reached LSN {min_lsn} "
+                        f"(applied {self.applied_lsn})"
+                    )
+            lsn = self.applied_lsn
+            # Row value lists are replaced, never mutated, so copying the slot
+            # arrays is enough; building the dicts happens outside the lock
+            raw = {
+                name: (state.columns, list(state.slots))
+                for name, state in self.tables.items()
+            }
+
+        return StateSnapshot(
+            lsn=lsn,
+            tables={
+                name: [dict(zip(columns, v)) for v in slots if v is not None]
+                for name, (columns, slots) in raw.items()
+            },
+        )
+
+    def checkpoint(self):
+        """Write the current state to disk (atomically replaced)"""
+        if not self.checkpoint_file:
+            return
+
+        with self.lock:
+            lsn = self.applied_lsn
+            raw = {
+                name: (state.columns, state.key_columns, list(state.slots))
+                for name, state in self.tables.items()
+            }
+
+        data = {
+            "lsn": lsn,
+            "tables": {
+                name: {
+                    "columns": columns,
+                    "key_columns": key_columns,
+                    "rows": [v for v in slots if v is not None],
+                }
+                for name, (columns, key_columns, slots) in raw.items()
+            },
+        }
+
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.checkpoint_file)
+        self.checkpoint_lsn = data["lsn"]
+        logger.info(f"State store checkpointed at LSN {data['lsn']}")
+
+    def restore(self):
+        """Load the last checkpoint, if any"""
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return
+
+        with open(self.checkpoint_file) as f:
+            data = json.load(f)
+
+        with self.lock:
+            for name, table in data["tables"].items():
+                state = TableState(
+                    table["columns"], table["key_columns"], self.indexes.get(name)
+                )
+                for values in table["rows"]:
+                    state.upsert(dict(zip(table["columns"], values)))
+                self.tables[name] = state
+            self.applied_lsn = self.checkpoint_lsn = data["lsn"]
+
+        logger.info(f"State store restored at LSN {data['lsn']}")
+
+    def _prepare_changes(self, events: List[CDCEvent]) -> Dict[str, TableChanges]:
+        """
+        Final row per key (None for deleted) for each table a transaction
+        touches, computed without modifying the store.
+        """
+        changes: Dict[str, TableChanges] = {}
+        for event in events:
+            qualified = f"{event.schema}.{event.table}"
+            key_columns = self.table_keys.get(qualified) or event.key_columns
+            if not key_columns:
+                logger.warning(f"No key columns for {qualified}, event skipped")
+                continue
+
+            _, _, rows = changes.get(qualified, (None, None, {}))
+            changes[qualified] = (event.columns, key_columns, rows)
+            state = self.tables.get(qualified)
+
+            if event.operation in ("UPDATE", "DELETE") and event.old_values:
+                old_key = tuple(event.old_values.get(name) for name in key_columns)
+                if event.operation == "DELETE" or (
+                    event.new_values
+                    and old_key != tuple(event.new_values.get(n) for n in key_columns)
+                ):
+                    rows[old_key] = None
+
+            if event.operation in ("INSERT", "UPDATE") and event.new_values:
+                row = event.new_values
+                key = tuple(row.get(name) for name in key_columns)
+                if any(value is UNCHANGED for value in row.values()):
+                    # Keep the stored value of TOAST columns that were not resent
+                    if key in rows:
+                        current = rows[key] or {}
+                    else:
+                        current = (state.get(key) if state else None) or {}
+                    row = {
+                        name: current.get(name) if value is UNCHANGED else value
+                        for name, value in row.items()
+                    }
+                rows[key] = dict(row)
+        return changes